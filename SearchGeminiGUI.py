@@ -1,131 +1,48 @@
-import requests
-from bs4 import BeautifulSoup
-from googlesearch import search
-import time
-import json
-import toml
-from typing import List, Dict
+import httpx
+import asyncio
+import orjson
 import streamlit as st
+from typing import Callable
+
+from config import load_config
+from prompts import PROMPT_PREFIX, EMOJI_SUFFIX
+from semantic_cache import shared_cache
+from web_utils import gather_context
+
+@st.cache_resource
+def _gemini_client() -> httpx.Client:
+    """HTTP/2 client shared across reruns, so calls reuse one TLS connection to the API."""
+    return httpx.Client(http2=True, timeout=30)
 
 class GeminiWebWrapper:
-    def __init__(self):
+    def __init__(self, model_name: str = "gemini-1.5-flash-8b"):
+        self.model_name = model_name
         self.api_key = self.load_api_key()
-        self.api_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-8b:generateContent"
+        self.api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:streamGenerateContent"
 
     def load_api_key(self) -> str:
         """Load the Gemini API key from a TOML file."""
         try:
-            config = toml.load("SearchShellGPT.toml")
+            config = load_config()
             return config['gemini']['api_key']
         except Exception as e:
             raise RuntimeError("Failed to load API key from SearchShellGPT.toml") from e
 
-    def search_web(self, query: str, num_results: int = 3) -> List[Dict]:
-        """Search the web using Google and return results."""
-        try:
-            results = []
-            for url in search(query, num_results=num_results):
-                results.append({
-                    'href': url,
-                    'title': self._get_page_title(url),
-                    'body': ''
-                })
-            return results
-        except Exception as e:
-            st.error(f"Error searching web: {e}")
-            return []
+    def query_gemini(self, prompt: str, context: str,
+                     on_chunk: Callable[[str], None] | None = None) -> str:
+        """Query Gemini with the given prompt and context, streaming the answer over SSE.
 
-    def _get_page_title(self, url: str) -> str:
-        """Extract the title from a webpage."""
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=5)
-            response.raise_for_status()
+        on_chunk, if given, is called with the response so far as chunks arrive.
+        """
+        if not context.strip():
+            return "No context was found from web searches. The model will provide a general response without current information."
 
-            soup = BeautifulSoup(response.text, 'html.parser')
-            title = soup.title.string if soup.title else url
-            return title.strip()
-        except Exception:
-            return url
+        cached = shared_cache().get(self.model_name, prompt, context, EMOJI_SUFFIX)
+        if cached is not None:
+            return cached
 
-    def extract_content(self, url: str) -> str:
-        """Extract main content from a webpage."""
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            for element in soup(['script', 'style', 'nav', 'header', 'footer', 'iframe', 'noscript']):
-                element.decompose()
-
-            main_content = soup.find('main') or soup.find('article') or soup.find('div', {'class': ['content', 'main', 'article']})
-            if main_content:
-                text = main_content.get_text(separator='\n', strip=True)
-            else:
-                text = soup.get_text(separator='\n', strip=True)
-
-            lines = [line.strip() for line in text.split('\n') if line.strip()]
-            cleaned_text = '\n'.join(lines)
-
-            return cleaned_text[:2000]
-        except Exception as e:
-            st.error(f"Error extracting content from {url}: {e}")
-            return ""
-
-    def generate_context(self, query: str, num_results: int = 3) -> str:
-        """Generate context from web search results."""
-        results = self.search_web(query, num_results)
-        context = []
-
-        for result in results:
-            url = result['href']
-            title = result['title']
-
-            st.info(f"Fetching content from: {url}")
-            content = self.extract_content(url)
-
-            if content:
-                context_entry = (
-                    f"Source: {title}\n"
-                    f"URL: {url}\n\n"
-                    f"Content:\n{content}\n"
-                    f"{'='*50}\n"
-                )
-                context.append(context_entry)
-            else:
-                context_entry = (
-                    f"Source: {title}\n"
-                    f"URL: {url}\n"
-                    f"{'='*50}\n"
-                )
-                context.append(context_entry)
-
-            time.sleep(1)
-
-        return "\n".join(context)
-
-    def query_gemini(self, prompt: str, context: str) -> str:
-        """Query Gemini with the given prompt and context using direct API call."""
-        try:
-            if not context.strip():
-                return "No context was found from web searches. The model will provide a general response without current information."
-
-            full_prompt = (
-                f"Context from web searches:\n\n{context}\n\n"
-                f"Question: {prompt}\n\n"
-                f"Please provide a comprehensive answer based on the context above. "
-                f"Please ensure the answer is detailed with points wherever necessary. "
-                f"Use emojis wherever needed to make your answers interesting"
-                f"Please ensure that the answer is properly formatted for reading. "
-                f"If the context doesn't contain relevant information, please state so clearly, and instead \
-                    provide whatever info you have on the topic."
-            )
+            full_prompt = PROMPT_PREFIX.format(context=context, prompt=prompt) + EMOJI_SUFFIX
 
             headers = {
                 "Content-Type": "application/json",
@@ -146,47 +63,59 @@ class GeminiWebWrapper:
                 }
             }
 
-            response = requests.post(
-                f"{self.api_url}?key={self.api_key}",
+            with _gemini_client().stream(
+                "POST",
+                f"{self.api_url}?alt=sse&key={self.api_key}",
                 headers=headers,
-                json=data,
-                timeout=30
-            )
-            
-            response.raise_for_status()
-            response_data = response.json()
-            
-            # Extract the generated text from the response
-            try:
-                return response_data['candidates'][0]['content']['parts'][0]['text']
-            except (KeyError, IndexError) as e:
-                return f"Error parsing Gemini response: {str(e)}"
-
-        except requests.exceptions.RequestException as e:
+                content=orjson.dumps(data)
+            ) as response:
+                response.raise_for_status()
+
+                # Each SSE event carries the next slice of the generated text
+                parts = []
+                try:
+                    for line in response.iter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        chunk = orjson.loads(line[5:])
+                        for part in chunk['candidates'][0]['content'].get('parts', []):
+                            parts.append(part.get('text', ''))
+                        if on_chunk:
+                            on_chunk("".join(parts))
+                except (KeyError, IndexError) as e:
+                    return f"Error parsing Gemini response: {str(e)}"
+
+            answer = "".join(parts)
+        except httpx.HTTPError as e:
             return f"Error querying Gemini API: {str(e)}"
         except Exception as e:
             return f"Unexpected error: {str(e)}"
 
+        shared_cache().put(self.model_name, prompt, context, answer, EMOJI_SUFFIX)
+        return answer
+
 def main():
     st.title("Search Shell")
     st.write("Type a search query and get a response from the Gemini 1.5 Flash model.")
 
     query = st.text_input("Search Query", placeholder="Enter your search query")
     show_context = st.checkbox("Show Context")
+    deep_fetch = st.checkbox("Fetch Full Pages", value=True)
     num_results = st.number_input("Number of Results", min_value=1, max_value=10, value=3, step=1)
 
     if st.button("Search"):
         wrapper = GeminiWebWrapper()
-        context = wrapper.generate_context(query, num_results)
+        context = asyncio.run(gather_context(query, num_results, deep_fetch=deep_fetch))
 
         if show_context:
             st.write("Context gathered from web:")
             st.write(context)
             st.write("Generating response...")
 
-        response = wrapper.query_gemini(query, context)
         st.write("Response:")
-        st.write(response)
+        placeholder = st.empty()
+        response = wrapper.query_gemini(query, context, on_chunk=placeholder.markdown)
+        placeholder.write(response)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,12 +1,34 @@
 import os
-import toml
-import requests
-from bs4 import BeautifulSoup
-from googlesearch import search
 import asyncio
-import openai_async
+import httpx
+import orjson
 import streamlit as st
 from collections import deque
+from typing import Callable
+from openai import AsyncOpenAI
+
+from config import load_config
+from prompts import PROMPT_PREFIX, GEMINI_SUFFIX, PLAIN_SUFFIX
+from semantic_cache import shared_cache
+from web_utils import approx_tokens, fit_results, openai_tokens, search_web
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """Event loop kept for the browser session, so async clients outlive a single submit."""
+    if "event_loop" not in st.session_state:
+        st.session_state.event_loop = asyncio.new_event_loop()
+    return st.session_state.event_loop
+
+def _gemini_client() -> httpx.AsyncClient:
+    """HTTP/2 client for the session's event loop; concurrent Gemini calls share one connection."""
+    if "gemini_client" not in st.session_state:
+        st.session_state.gemini_client = httpx.AsyncClient(http2=True, timeout=30)
+    return st.session_state.gemini_client
+
+def _openai_client(api_key: str) -> AsyncOpenAI:
+    """OpenAI client for the session's event loop, so its connection pool outlives a single submit."""
+    if "openai_client" not in st.session_state:
+        st.session_state.openai_client = AsyncOpenAI(api_key=api_key, timeout=30)
+    return st.session_state.openai_client
 
 class OpenAIWebWrapper:
     def __init__(self, model_name: str = "gpt-4o-mini"):
@@ -16,129 +38,72 @@ class OpenAIWebWrapper:
     def _load_api_key(self, provider: str) -> str:
         """Load the API key from a TOML file."""
         try:
-            config = toml.load("SearchShellGPT.toml")
+            config = load_config()
             return config[provider]['api_key']
         except Exception as e:
             raise RuntimeError(f"Failed to load API key from config.toml for {provider}") from e
 
-    def search_web(self, query: str, num_results: int = 5) -> list[dict]:
-        """Search the web using Google and return results."""
-        try:
-            results = []
-            st.write(f"Searching for: {query}")
-            for url in search(query, num_results=num_results):
-                st.write(f"Found URL: {url}")
-                results.append({
-                    'href': url,
-                    'title': self._get_page_title(url),
-                    'body': self.extract_content(url)
-                })
-            if not results:
-                st.error("No results were found.")
-            return results
-        except Exception as e:
-            st.error(f"Error searching web: {e}")
-            return []
-
-
-    def _get_page_title(self, url: str) -> str:
-        """Extract the title from a webpage."""
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=5)
-            response.raise_for_status()
-
-            soup = BeautifulSoup(response.text, 'html.parser')
-            title = soup.title.string if soup.title else url
-            return title.strip()
-        except Exception:
-            return url
-
-    def extract_content(self, url: str) -> str:
-        """Extract main content from a webpage."""
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            for element in soup(['script', 'style', 'nav', 'header', 'footer', 'iframe', 'noscript']):
-                element.decompose()
-
-            main_content = soup.find('main') or soup.find('article') or soup.find('div', {'class': ['content', 'main', 'article']})
-            if main_content:
-                text = main_content.get_text(separator='\n', strip=True)
-            else:
-                text = soup.get_text(separator='\n', strip=True)
+    async def query_openai_async(self, prompt: str, context: str,
+                                 on_chunk: Callable[[str], None] | None = None) -> str:
+        """Query OpenAI with the given prompt and context, streaming the answer.
 
-            lines = [line.strip() for line in text.split('\n') if line.strip()]
-            cleaned_text = '\n'.join(lines)
+        on_chunk, if given, is called with the response so far as tokens arrive.
+        """
+        if not context.strip():
+            return "No context was found from web searches. The model will provide a general response without current information."
 
-            return cleaned_text[:2000]
-        except Exception as e:
-            st.error(f"Error extracting content from {url}: {e}")
-            return ""
+        cached = shared_cache().get(self.model_name, prompt, context, PLAIN_SUFFIX)
+        if cached is not None:
+            return cached
 
-    async def query_openai_async(self, prompt: str, context: str) -> str:
-        """Query OpenAI with the given prompt and context using openai-async."""
         try:
-            if not context.strip():
-                return "No context was found from web searches. The model will provide a general response without current information."
-
-            full_prompt = (
-                f"Context from web searches:\n\n{context}\n\n"
-                f"Question: {prompt}\n\n"
-                f"Please provide a comprehensive answer based on the context above. "
-                f"Please ensure the answer is detailed with points wherever necessary. "
-                f"Please ensure that the answer is properly formatted for reading. "
-                f"If the context doesn't contain relevant information, please state that clearly."
+            full_prompt = PROMPT_PREFIX.format(context=context, prompt=prompt) + PLAIN_SUFFIX
+
+            stream = await _openai_client(self.api_key).chat.completions.create(
+                model=self.model_name,
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": full_prompt}
+                ],
+                max_tokens=2000,
+                stream=True
             )
 
-            response = await openai_async.chat_complete(
-                api_key=self.api_key,
-                timeout=30,
-                payload={
-                    "model": self.model_name,
-                    "messages": [
-                        {"role": "system", "content": "You are a helpful assistant."},
-                        {"role": "user", "content": full_prompt}
-                    ],
-                    "max_tokens": 2000
-                }
-            )
+            parts = []
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    if on_chunk:
+                        on_chunk("".join(parts))
 
-            response_json = response.json()
-            return response_json['choices'][0]['message']['content'].strip()
+            answer = "".join(parts).strip()
         except Exception as e:
             return f"Error querying OpenAI: {e}"
 
+        shared_cache().put(self.model_name, prompt, context, answer, PLAIN_SUFFIX)
+        return answer
+
 class GeminiWebWrapper(OpenAIWebWrapper):
     def __init__(self, model_name: str = "gemini-1.5-flash-8b"):
         super().__init__(model_name)
         self.api_key = self._load_api_key("gemini")
-        self.api_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-8b:generateContent"
+        self.api_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-8b:streamGenerateContent"
+
+    async def query_gemini_async(self, prompt: str, context: str,
+                                 on_chunk: Callable[[str], None] | None = None) -> str:
+        """Query Gemini with the given prompt and context, streaming the answer over SSE.
+
+        on_chunk, if given, is called with the response so far as chunks arrive.
+        """
+        if not context.strip():
+            return "No context was found from web searches. The model will provide a general response without current information."
+
+        cached = shared_cache().get(self.model_name, prompt, context, GEMINI_SUFFIX)
+        if cached is not None:
+            return cached
 
-    async def query_gemini_async(self, prompt: str, context: str) -> str:
-        """Query Gemini with the given prompt and context using direct API call."""
         try:
-            if not context.strip():
-                return "No context was found from web searches. The model will provide a general response without current information."
-
-            full_prompt = (
-                f"Context from web searches:\n\n{context}\n\n"
-                f"Question: {prompt}\n\n"
-                f"Please provide a comprehensive answer based on the context above. "
-                f"Please ensure the answer is detailed with points wherever necessary. "
-                f"ALWAYS incorporate emojis wherever possible and relevant to make your answers interesting"
-                f"Please ensure that the answer is properly formatted for reading. "
-                f"If the context doesn't contain relevant information, please state so clearly, and instead \
-                    provide whatever info you have on the topic."
-            )
+            full_prompt = PROMPT_PREFIX.format(context=context, prompt=prompt) + GEMINI_SUFFIX
 
             headers = {
                 "Content-Type": "application/json",
@@ -159,27 +124,46 @@ class GeminiWebWrapper(OpenAIWebWrapper):
                 }
             }
 
-            response = requests.post(
-                f"{self.api_url}?key={self.api_key}",
+            async with _gemini_client().stream(
+                "POST",
+                f"{self.api_url}?alt=sse&key={self.api_key}",
                 headers=headers,
-                json=data,
-                timeout=30
-            )
-
-            response.raise_for_status()
-            response_data = response.json()
-
-            # Extract the generated text from the response
-            try:
-                return response_data['candidates'][0]['content']['parts'][0]['text']
-            except (KeyError, IndexError) as e:
-                return f"Error parsing Gemini response: {str(e)}"
-
-        except requests.exceptions.RequestException as e:
+                content=orjson.dumps(data)
+            ) as response:
+                response.raise_for_status()
+
+                # Each SSE event carries the next slice of the generated text
+                parts = []
+                try:
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        chunk = orjson.loads(line[5:])
+                        for part in chunk['candidates'][0]['content'].get('parts', []):
+                            parts.append(part.get('text', ''))
+                        if on_chunk:
+                            on_chunk("".join(parts))
+                except (KeyError, IndexError) as e:
+                    return f"Error parsing Gemini response: {str(e)}"
+
+            answer = "".join(parts)
+        except httpx.HTTPError as e:
             return f"Error querying Gemini API: {str(e)}"
         except Exception as e:
             return f"Unexpected error: {str(e)}"
 
+        shared_cache().put(self.model_name, prompt, context, answer, GEMINI_SUFFIX)
+        return answer
+
+async def query_both(gpt_wrapper: OpenAIWebWrapper, gemini_wrapper: GeminiWebWrapper,
+                     prompt: str, context: str,
+                     on_gpt_chunk: Callable[[str], None] | None = None,
+                     on_gemini_chunk: Callable[[str], None] | None = None) -> list[str]:
+    """Query GPT and Gemini concurrently, returning their responses in that order."""
+    return await asyncio.gather(
+        gpt_wrapper.query_openai_async(prompt, context, on_gpt_chunk),
+        gemini_wrapper.query_gemini_async(prompt, context, on_gemini_chunk)
+    )
 
 def main():
     # Set the page configuration with title and icon
@@ -188,9 +172,11 @@ def main():
     # Sidebar for model selection
     st.sidebar.title("Model Selection")
     model_type = st.sidebar.radio("Select Model", ("GPT", "Gemini"))
+    compare_models = st.sidebar.checkbox("Compare models")
 
     # Slider for selecting number of search results
     num_results = st.sidebar.slider("Number of Search Results", min_value=1, max_value=10, value=3)
+    deep_fetch = st.sidebar.checkbox("Fetch Full Pages", value=True)
 
     # Main chatbot area with page title
     st.title("SearchShell")
@@ -205,16 +191,22 @@ def main():
     if submit_button and user_input.strip():
         #st.write(f"User input received: {user_input}")
         chat_history.append(("User", user_input))
+        loop = _event_loop()
 
-        if model_type == "GPT":
+        if compare_models:
+            gpt_wrapper, gemini_wrapper = OpenAIWebWrapper(), GeminiWebWrapper()
+        elif model_type == "GPT":
             wrapper = OpenAIWebWrapper()
         else:
             wrapper = GeminiWebWrapper()
 
         # Search the web with selected number of results
-        web_results = wrapper.search_web(user_input, num_results)
+        st.write(f"Searching for: {user_input}")
+        web_results = loop.run_until_complete(search_web(user_input, num_results, deep_fetch))
         if not web_results:
             st.error("No web search results found.")
+        count_tokens = openai_tokens if compare_models or model_type == "GPT" else approx_tokens
+        web_results = fit_results(web_results, user_input, count_tokens=count_tokens)
 
         # Build context from web results
         context = "\n\n".join(f"{result['title']}\n{result['body']}" for result in web_results)
@@ -224,13 +216,29 @@ def main():
             st.write("Context obtained from web searches. Ingesting ... ")
             #st.write(context)
 
-        # Async query to the selected model
-        if model_type == "GPT":
-            response = asyncio.run(wrapper.query_openai_async(user_input, context))
+        # Async query to the selected model, or to both at once when comparing.
+        # Partial answers stream into placeholders that the chat history replaces.
+        if compare_models:
+            gpt_placeholder, gemini_placeholder = st.empty(), st.empty()
+            gpt_response, gemini_response = loop.run_until_complete(query_both(
+                gpt_wrapper, gemini_wrapper, user_input, context,
+                on_gpt_chunk=lambda text: gpt_placeholder.markdown(f"**Chatbot:** [Model: GPT] {text}"),
+                on_gemini_chunk=lambda text: gemini_placeholder.markdown(f"**Chatbot:** [Model: Gemini] {text}")
+            ))
+            gpt_placeholder.empty()
+            gemini_placeholder.empty()
+            chat_history.append(("Bot", f"[Model: GPT] {gpt_response}"))
+            chat_history.append(("Bot", f"[Model: Gemini] {gemini_response}"))
         else:
-            response = asyncio.run(wrapper.query_gemini_async(user_input, context))
+            placeholder = st.empty()
+            on_chunk = lambda text: placeholder.markdown(f"**Chatbot:** {text}")
+            if model_type == "GPT":
+                response = loop.run_until_complete(wrapper.query_openai_async(user_input, context, on_chunk))
+            else:
+                response = loop.run_until_complete(wrapper.query_gemini_async(user_input, context, on_chunk))
+            placeholder.empty()
 
-        chat_history.append(("Bot", response))
+            chat_history.append(("Bot", response))
 
     # Display chat history
     for sender, message in chat_history:
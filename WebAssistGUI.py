@@ -1,91 +1,153 @@
 import os
-import toml
-import requests
-from bs4 import BeautifulSoup
-from googlesearch import search
+import re
+import logging
+import time
 import asyncio
-import openai_async
+import aiohttp
+import orjson
 import streamlit as st
-from collections import deque
+import numpy as np
+from collections import OrderedDict, deque
+from typing import Callable
+from openai import AsyncOpenAI
+
+from config import load_config
+from semantic_cache import embed
+from web_utils import search_web
+
+# Turns kept verbatim in the chat history; older ones are folded into a running summary.
+_HISTORY_LENGTH = 40
+
+# Phrases in a message that trigger a web search even when it is switched off.
+_TRIGGER_RE = re.compile(r'\b(?:search|look up|find out|what is|who is)\b', re.IGNORECASE)
+
+# Words that don't change what a search is about; every other term must match for a fuzzy hit.
+_STOPWORDS = frozenset(
+    "a an and are at be by can do does for from how i in is it me of on or show tell "
+    "that the this to was what when where which who why with".split()
+)
+
+logger = logging.getLogger(__name__)
+
+def _search_terms(key: str) -> frozenset[str]:
+    """The words of a normalized query that carry its meaning, e.g. the entities it names."""
+    return frozenset(re.findall(r'\w+', key)) - _STOPWORDS
 
 class BaseChatbot:
+    _SYSTEM_PROMPT = (
+        "You are a helpful AI assistant with access to web search capabilities. "
+        "You can search the internet when needed to provide up-to-date information. "
+        "Always maintain context of the conversation and provide accurate, relevant responses. "
+        "ALWAYS incorporate emojis wherever possible and relevant to make your answers interesting.\n\n"
+    )
+    _SUMMARY_PROMPT = (
+        "Summarize the conversation below in a few sentences, keeping names, facts and open questions. "
+        "Merge it into the existing summary, if one is given.\n\n"
+    )
+
+    # Search results are reused for this long, and for differently worded queries with the
+    # same key terms this similar.
+    _SEARCH_TTL = 600
+    _SEARCH_SIMILARITY = 0.85
+    _SEARCH_CACHE_SIZE = 64
+
+    def __init__(self):
+        # Normalized query -> (time cached, key terms, query embedding or None, results), oldest first.
+        self._search_cache: OrderedDict[str, tuple[float, frozenset[str], np.ndarray | None, list[dict]]] = OrderedDict()
+
     def _load_api_key(self, provider: str) -> str:
         """Load the API key from a TOML file."""
         try:
-            config = toml.load("SearchShellGPT.toml")
+            config = load_config()
             return config[provider]['api_key']
         except Exception as e:
             raise RuntimeError(f"Failed to load API key from config.toml for {provider}") from e
 
-    def search_web(self, query: str, num_results: int = 3) -> list[dict]:
-        """Search the web only when needed."""
-        try:
-            results = []
-            with st.spinner('🔍 Searching the web...'):
-                for url in search(query, num_results=num_results):
-                    results.append({
-                        'href': url,
-                        'title': self._get_page_title(url),
-                        'body': self.extract_content(url)
-                    })
-            return results
-        except Exception as e:
-            st.error(f"Error searching web: {e}")
-            return []
-
-    def _get_page_title(self, url: str) -> str:
-        """Extract the title from a webpage."""
+    async def close(self):
+        """Release any connections held by the chatbot before its event loop closes."""
+
+    def _summary_request(self, summary: str, turns: list) -> str:
+        """Build the prompt asking a model to fold evicted turns into the running summary."""
+        parts = [self._SUMMARY_PROMPT]
+        if summary:
+            parts.append(f"Existing summary:\n{summary}\n\n")
+        parts.extend(f"{'User' if role == 'user' else 'Assistant'}: {content}\n\n" for role, content in turns)
+        return "".join(parts)
+
+    def _cached_search(self, key: str) -> list[dict] | None:
+        """Return fresh results for the same query, or failing that for the most similar one.
+
+        A differently worded query only matches if it names the same key terms, so "CEO of
+        Apple" never reuses the results for "CEO of Google". The similarity tier is
+        best-effort: if the query can't be embedded, only exact repeats are served.
+        """
+        now = time.monotonic()
+        for cached_key, (cached_at, _, _, _) in list(self._search_cache.items()):
+            if now - cached_at > self._SEARCH_TTL:
+                del self._search_cache[cached_key]
+
+        if key in self._search_cache:
+            self._search_cache.move_to_end(key)
+            return self._search_cache[key][3]
+
+        terms = _search_terms(key)
+        entries = [entry for entry in self._search_cache.values()
+                   if entry[1] == terms and entry[2] is not None]
+        if not entries:
+            return None
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=5)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-            return soup.title.string.strip() if soup.title else url
+            query_embedding = embed(key)
         except Exception:
-            return url
-
-    def extract_content(self, url: str) -> str:
-        """Extract main content from a webpage."""
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            for element in soup(['script', 'style', 'nav', 'header', 'footer']):
-                element.decompose()
-
-            main_content = (soup.find('main') or soup.find('article') or 
-                          soup.find('div', {'class': ['content', 'main', 'article']}))
-            
-            text = main_content.get_text(separator='\n', strip=True) if main_content else \
-                   soup.get_text(separator='\n', strip=True)
-            
-            lines = [line.strip() for line in text.split('\n') if line.strip()]
-            return '\n'.join(lines)[:2000]
-        except Exception as e:
-            st.error(f"Error extracting content from {url}: {e}")
-            return ""
+            logger.warning("Query embedding failed; skipping similar-search lookup", exc_info=True)
+            return None
+        scores = np.stack([entry[2] for entry in entries]) @ query_embedding
+        best = int(np.argmax(scores))
+        return entries[best][3] if scores[best] >= self._SEARCH_SIMILARITY else None
+
+    async def search_web(self, query: str, num_results: int = 3) -> list[dict]:
+        """Search the web only when needed, fetching the result pages concurrently."""
+        key = query.strip().lower()
+        cached = self._cached_search(key)
+        if cached is not None:
+            return cached
+
+        with st.spinner('🔍 Searching the web...'):
+            results = await search_web(query, num_results)
+        if results:
+            try:
+                query_embedding = embed(key)
+            except Exception:
+                logger.warning("Query embedding failed; caching search for exact repeats only", exc_info=True)
+                query_embedding = None
+            self._search_cache[key] = (time.monotonic(), _search_terms(key), query_embedding, results)
+            if len(self._search_cache) > self._SEARCH_CACHE_SIZE:
+                self._search_cache.popitem(last=False)
+        return results
 
 class OpenAIChatbot(BaseChatbot):
+    provider_name = "GPT"
+
     def __init__(self, model_name: str = "gpt-4"):
+        super().__init__()
         self.model_name = model_name
         self.api_key = self._load_api_key("openai")
+        self._client = AsyncOpenAI(api_key=self.api_key, timeout=30)
 
-    async def chat(self, user_input: str, chat_history: list, should_search: bool = False) -> str:
+    async def close(self):
+        """Close the client's connection pool; it cannot outlive the event loop it was used on."""
+        await self._client.close()
+
+    async def chat(self, user_input: str, chat_history: list, should_search: bool = False,
+                   summary: str = "", on_chunk: Callable[[str], None] | None = None) -> str:
         try:
-            messages = self._build_chat_history(chat_history)
+            messages = self._build_chat_history(chat_history, summary)
             
-            if should_search or any(trigger in user_input.lower() 
-                                  for trigger in ['search', 'look up', 'find out', 'what is', 'who is']):
-                web_results = self.search_web(user_input)
-                context = "\n\n".join(f"{r['title']}\n{r['body']}" for r in web_results)
-                
-                if context.strip():
+            if should_search or _TRIGGER_RE.search(user_input):
+                web_results = await self.search_web(user_input)
+                parts = [f"{r['title']}\n{r['body']}" for r in web_results if r['body']]
+
+                if parts:
+                    context = "\n\n".join(parts)
                     messages.append({
                         "role": "system",
                         "content": f"Additional context from web search:\n\n{context}"
@@ -93,54 +155,83 @@ class OpenAIChatbot(BaseChatbot):
 
             messages.append({"role": "user", "content": user_input})
 
-            response = await openai_async.chat_complete(
-                api_key=self.api_key,
-                timeout=30,
-                payload={
-                    "model": self.model_name,
-                    "messages": messages,
-                    "max_tokens": 2000,
-                    "temperature": 0.7
-                }
+            stream = await self._client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                max_tokens=2000,
+                temperature=0.7,
+                stream=True
             )
 
-            return response.json()['choices'][0]['message']['content'].strip()
+            parts = []
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    if on_chunk:
+                        on_chunk("".join(parts))
+
+            return "".join(parts).strip()
 
         except Exception as e:
             return f"Error: {str(e)}"
 
-    def _build_chat_history(self, chat_history: list) -> list:
+    async def summarize(self, summary: str, turns: list) -> str:
+        """Fold turns dropped from the history window into the running summary."""
+        try:
+            response = await self._client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": self._summary_request(summary, turns)}],
+                max_tokens=300
+            )
+            return response.choices[0].message.content.strip()
+        except Exception:
+            return summary
+
+    def _build_chat_history(self, chat_history: list, summary: str = "") -> list:
         """Build the chat history in the format required by the API."""
-        messages = [{
-            "role": "system",
-            "content": "You are a helpful AI assistant with access to web search capabilities. "
-                      "You can search the internet when needed to provide up-to-date information. "
-                      "Always maintain context of the conversation and provide accurate, relevant responses."
-                      "ALWAYS incorporate emojis wherever possible and relevant to make your answers interesting.\n\n"
-        }]
-        
-        for role, content in chat_history:
-            messages.append({"role": role, "content": content})
-            
+        messages = [{"role": "system", "content": self._SYSTEM_PROMPT}]
+        if summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+        messages.extend({"role": role, "content": content} for role, content in chat_history)
         return messages
 
-import aiohttp
-
 class GeminiChatbot(BaseChatbot):
+    provider_name = "Gemini"
+
     def __init__(self, model_name: str = "gemini-1.5-flash-8b"):
+        super().__init__()
         self.model_name = model_name
         self.api_key = self._load_api_key("gemini")
         self.api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent"
+        self.stream_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:streamGenerateContent"
+        self._session = None
+        self._session_loop = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Return the pooled session, creating it on first use or when the event loop has changed."""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=100, limit_per_host=20, keepalive_timeout=75)
+            )
+            self._session_loop = loop
+        return self._session
+
+    async def close(self):
+        """Close the pooled session; it cannot outlive the event loop it was created on."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
 
-    async def chat(self, user_input: str, chat_history: list, should_search: bool = False) -> str:
+    async def chat(self, user_input: str, chat_history: list, should_search: bool = False,
+                   summary: str = "", on_chunk: Callable[[str], None] | None = None) -> str:
         try:
-            conversation = self._build_chat_history(chat_history)
+            conversation = self._build_chat_history(chat_history, summary)
 
-            if should_search or any(trigger in user_input.lower() 
-                                  for trigger in ['search', 'look up', 'find out', 'what is', 'who is']):
-                web_results = self.search_web(user_input)
-                context = "\n\n".join(f"{r['title']}\n{r['body']}" for r in web_results)
-                if context.strip():
+            if should_search or _TRIGGER_RE.search(user_input):
+                web_results = await self.search_web(user_input)
+                parts = [f"{r['title']}\n{r['body']}" for r in web_results if r['body']]
+                if parts:
+                    context = "\n\n".join(parts)
                     conversation += f"\nAdditional context from web search:\n\n{context}"
 
             conversation += f"\nUser: {user_input}\nAssistant: "
@@ -164,38 +255,61 @@ class GeminiChatbot(BaseChatbot):
                 }
             }
 
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{self.api_url}?key={self.api_key}",
-                    headers=headers,
-                    json=data,
-                    timeout=30
-                ) as response:
-
-                    response.raise_for_status()
-                    response_data = await response.json()
-
-                    try:
-                        return response_data['candidates'][0]['content']['parts'][0]['text']
-                    except (KeyError, IndexError) as e:
-                        return f"Error parsing Gemini response: {str(e)}"
+            session = await self._get_session()
+            async with session.post(
+                f"{self.stream_url}?alt=sse&key={self.api_key}",
+                headers=headers,
+                json=data,
+                timeout=aiohttp.ClientTimeout(total=30)
+            ) as response:
+
+                response.raise_for_status()
+
+                # Each SSE event carries the next slice of the generated text
+                parts = []
+                try:
+                    async for line in response.content:
+                        if not line.startswith(b"data:"):
+                            continue
+                        chunk = orjson.loads(line[5:])
+                        for part in chunk['candidates'][0]['content'].get('parts', []):
+                            parts.append(part.get('text', ''))
+                        if on_chunk:
+                            on_chunk("".join(parts))
+                except (KeyError, IndexError) as e:
+                    return f"Error parsing Gemini response: {str(e)}"
+                return "".join(parts)
 
         except Exception as e:
             return f"Error: {str(e)}"
 
 
-    def _build_chat_history(self, chat_history: list) -> str:
+    async def summarize(self, summary: str, turns: list) -> str:
+        """Fold turns dropped from the history window into the running summary."""
+        try:
+            session = await self._get_session()
+            async with session.post(
+                f"{self.api_url}?key={self.api_key}",
+                headers={"Content-Type": "application/json", "x-goog-api-key": self.api_key},
+                json={
+                    "contents": [{"parts": [{"text": self._summary_request(summary, turns)}]}],
+                    "generationConfig": {"maxOutputTokens": 300}
+                },
+                timeout=aiohttp.ClientTimeout(total=30)
+            ) as response:
+                response.raise_for_status()
+                response_data = await response.json()
+                return response_data['candidates'][0]['content']['parts'][0]['text'].strip()
+        except Exception:
+            return summary
+
+    def _build_chat_history(self, chat_history: list, summary: str = "") -> str:
         """Build the chat history in the format required by Gemini API."""
-        conversation = "You are a helpful AI assistant with access to web search capabilities. " \
-                      "You can search the internet when needed to provide up-to-date information. " \
-                      "Always maintain context of the conversation and provide accurate, relevant responses. " \
-                      "ALWAYS incorporate emojis wherever possible and relevant to make your answers interesting.\n\n"
-        
-        for role, content in chat_history:
-            prefix = "User: " if role == "user" else "Assistant: "
-            conversation += f"{prefix}{content}\n\n"
-            
-        return conversation
+        parts = [self._SYSTEM_PROMPT]
+        if summary:
+            parts.append(f"Summary of the earlier conversation:\n{summary}\n\n")
+        parts.extend(f"{'User' if role == 'user' else 'Assistant'}: {content}\n\n" for role, content in chat_history)
+        return "".join(parts)
 
 
 def create_message_container():
@@ -205,9 +319,14 @@ def create_message_container():
 def init_session_state():
     """Initialize session state variables."""
     if 'messages' not in st.session_state:
-        st.session_state.messages = []
+        st.session_state.messages = deque(maxlen=_HISTORY_LENGTH)
+    if 'summary' not in st.session_state:
+        st.session_state.summary = ""
     if 'chatbot' not in st.session_state:
         st.session_state.chatbot = None
+    if 'event_loop' not in st.session_state:
+        # Kept for the whole session so pooled connections survive between messages
+        st.session_state.event_loop = asyncio.new_event_loop()
     if 'user_input' not in st.session_state:
         st.session_state.user_input = ""  # Initialize user_input
 
@@ -221,10 +340,20 @@ def display_messages(container):
             else:
                 st.markdown(f'<div style="margin-bottom: 10px;"><span style="background-color: #103e41; padding: 8px 12px; border-radius: 15px; display: inline-block; max-width: 70%;"><b>🤖 Assistant:</b> {content}</span></div>', unsafe_allow_html=True)
 
-async def async_chat(chatbot, user_input, chat_history, should_search):
-    response = await chatbot.chat(user_input, chat_history, should_search)
-    model_name = "GPT" if isinstance(chatbot, OpenAIChatbot) else "Gemini"
-    return response, model_name
+def make_room(messages: deque, count: int) -> list:
+    """Pop the oldest turns so count more fit, instead of letting the deque drop them unseen."""
+    return [messages.popleft() for _ in range(len(messages) + count - messages.maxlen)]
+
+async def async_chat(chatbot, user_input, chat_history, should_search, summary="", evicted=(), on_chunk=None):
+    """Get the chatbot's reply while folding any evicted turns into the summary alongside it."""
+    if evicted:
+        response, summary = await asyncio.gather(
+            chatbot.chat(user_input, [*evicted, *chat_history], should_search, summary, on_chunk),
+            chatbot.summarize(summary, evicted)
+        )
+    else:
+        response = await chatbot.chat(user_input, chat_history, should_search, summary, on_chunk)
+    return response, chatbot.provider_name, summary
 
 def main():
     st.set_page_config(page_title="AI Chatbot with Web Search", page_icon="🤖", layout="wide")
@@ -270,16 +399,16 @@ def main():
         should_search = st.checkbox("Enable Web Search", value=True)
         model_type = st.radio("Select Model", ("GPT", "Gemini"))
         if st.button("Clear Chat History"):
-            st.session_state.messages = []
+            st.session_state.messages = deque(maxlen=_HISTORY_LENGTH)
+            st.session_state.summary = ""
             st.rerun()
 
-    # Update chatbot based on selected model
-    if model_type == "GPT":
-        if not isinstance(st.session_state.chatbot, OpenAIChatbot):
-            st.session_state.chatbot = OpenAIChatbot()
-    else:
-        if not isinstance(st.session_state.chatbot, GeminiChatbot):
-            st.session_state.chatbot = GeminiChatbot()
+    # Update chatbot based on selected model, releasing the old one's connections
+    chatbot_class = OpenAIChatbot if model_type == "GPT" else GeminiChatbot
+    if not isinstance(st.session_state.chatbot, chatbot_class):
+        if st.session_state.chatbot is not None:
+            st.session_state.event_loop.run_until_complete(st.session_state.chatbot.close())
+        st.session_state.chatbot = chatbot_class()
 
     # Main chat interface
     st.title("🤖 AI Chatbot with Web Search")
@@ -302,20 +431,23 @@ def main():
 
     # Handle chat interaction
     if send_button and user_input.strip():
-        # Add user message to state
+        # Add user message to state, making room for it and the reply
+        evicted = make_room(st.session_state.messages, 2)
         st.session_state.messages.append(("user", user_input))
         
         # Get chatbot response
+        # Stream the reply into a placeholder; the rerun below shows it in the history
+        placeholder = st.empty()
         with st.spinner('Thinking...'):
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            response, model_name = loop.run_until_complete(async_chat(
-                st.session_state.chatbot, 
-                user_input, 
-                st.session_state.messages, 
-                should_search
+            response, model_name, st.session_state.summary = st.session_state.event_loop.run_until_complete(async_chat(
+                st.session_state.chatbot,
+                user_input,
+                st.session_state.messages,
+                should_search,
+                st.session_state.summary,
+                evicted,
+                placeholder.markdown
             ))
-            loop.close()
         
         # Add assistant response to state with model name
         st.session_state.messages.append(("assistant", f"[Model: {model_name}] {response}"))
@@ -0,0 +1,10 @@
+import tomllib
+from functools import lru_cache
+
+CONFIG_PATH = "SearchShellGPT.toml"
+
+@lru_cache(maxsize=1)
+def load_config() -> dict:
+    """Load the TOML config once per process; wrappers are rebuilt on every submit."""
+    with open(CONFIG_PATH, "rb") as f:
+        return tomllib.load(f)
@@ -0,0 +1,30 @@
+# The prompt's fixed text, built once; only the context and question vary per call.
+PROMPT_PREFIX = "Context from web searches:\n\n{context}\n\nQuestion: {prompt}\n\n"
+
+# SearchGPTGUI and SearchGeminiGUI.
+EMOJI_SUFFIX = (
+    "Please provide a comprehensive answer based on the context above. "
+    "Please ensure the answer is detailed with points wherever necessary. "
+    "Use emojis wherever needed to make your answers interesting. "
+    "Please ensure that the answer is properly formatted for reading. "
+    "If the context doesn't contain relevant information, please state so clearly, "
+    "and instead provide whatever info you have on the topic."
+)
+
+# SearchShellGUI, OpenAI side.
+PLAIN_SUFFIX = (
+    "Please provide a comprehensive answer based on the context above. "
+    "Please ensure the answer is detailed with points wherever necessary. "
+    "Please ensure that the answer is properly formatted for reading. "
+    "If the context doesn't contain relevant information, please state that clearly."
+)
+
+# SearchShellGUI, Gemini side.
+GEMINI_SUFFIX = (
+    "Please provide a comprehensive answer based on the context above. "
+    "Please ensure the answer is detailed with points wherever necessary. "
+    "ALWAYS incorporate emojis wherever possible and relevant to make your answers interesting. "
+    "Please ensure that the answer is properly formatted for reading. "
+    "If the context doesn't contain relevant information, please state so clearly, "
+    "and instead provide whatever info you have on the topic."
+)
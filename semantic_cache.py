@@ -0,0 +1,126 @@
+import logging
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+import numpy as np
+import xxhash
+from sentence_transformers import SentenceTransformer
+
+_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Bumped whenever the table layout changes; an older cache file is simply discarded.
+_SCHEMA_VERSION = 3
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=1)
+def _model() -> SentenceTransformer:
+    """Load the embedding model once per process."""
+    return SentenceTransformer(_EMBEDDING_MODEL, backend="onnx")
+
+@lru_cache(maxsize=256)
+def embed(text: str) -> np.ndarray:
+    """Embed text as a unit-length float32 vector, so a dot product is cosine similarity."""
+    return _model().encode(text, normalize_embeddings=True).astype(np.float32)
+
+def _hash(*texts: str) -> int:
+    """Fast non-cryptographic fingerprint, shifted into SQLite's signed 64-bit INTEGER range."""
+    digest = xxhash.xxh3_64()
+    for text in texts:
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.intdigest() - 2**63
+
+class SemanticCache:
+    """SQLite-backed cache of LLM responses for identical context and instructions.
+
+    An exact repeat of the query is found by key; otherwise the closest earlier query
+    by embedding similarity is used if it clears the threshold. The instructions (the
+    fixed prompt text around the query) are part of both keys, so front-ends asking
+    for differently styled answers never share entries.
+    """
+
+    def __init__(self, path: str = "searchshell_llm.sqlite", threshold: float = 0.92, ttl: float = 86400):
+        self.threshold = threshold
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+                self._conn.execute("DROP TABLE IF EXISTS responses")
+                self._conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(model TEXT, prompt_key INTEGER, context_hash INTEGER, embedding BLOB, response TEXT, ts REAL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_exact ON responses (model, prompt_key)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_lookup ON responses (model, context_hash)"
+            )
+
+    def get(self, model: str, query: str, context: str, instructions: str = "") -> str | None:
+        """Return a cached response for a similar query over the same context, if any.
+
+        The cache is best-effort: a failed lookup is logged and treated as a miss.
+        """
+        try:
+            return self._lookup(model, query, context, instructions)
+        except Exception:
+            logger.warning("Response cache lookup failed", exc_info=True)
+            return None
+
+    def _lookup(self, model: str, query: str, context: str, instructions: str) -> str | None:
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            exact = self._conn.execute(
+                "SELECT response FROM responses WHERE model = ? AND prompt_key = ? AND ts > ?",
+                (model, _hash(instructions, query, context), cutoff)
+            ).fetchone()
+            if exact:
+                return exact[0]
+            rows = self._conn.execute(
+                "SELECT embedding, response FROM responses "
+                "WHERE model = ? AND context_hash = ? AND ts > ? AND embedding IS NOT NULL",
+                (model, _hash(instructions, context), cutoff)
+            ).fetchall()
+        if not rows:
+            return None
+
+        matrix = np.frombuffer(b"".join(row[0] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+        scores = np.dot(matrix, embed(query))
+        best = int(np.argmax(scores))
+        return rows[best][1] if scores[best] > self.threshold else None
+
+    def put(self, model: str, query: str, context: str, response: str, instructions: str = "") -> None:
+        """Store a response and drop entries older than the TTL; empty responses are not stored.
+
+        If the query can't be embedded the response is still kept for exact repeats;
+        any other failure is logged and the response is simply not cached.
+        """
+        if not response.strip():
+            return
+        try:
+            embedding = embed(query).tobytes()
+        except Exception:
+            logger.warning("Query embedding failed; caching for exact repeats only", exc_info=True)
+            embedding = None
+        now = time.time()
+        try:
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM responses WHERE ts <= ?", (now - self.ttl,))
+                self._conn.execute(
+                    "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (model, _hash(instructions, query, context), _hash(instructions, context),
+                     embedding, response, now)
+                )
+        except sqlite3.Error:
+            logger.warning("Response cache write failed", exc_info=True)
+
+@lru_cache(maxsize=1)
+def shared_cache() -> SemanticCache:
+    """Open the response cache once per process; Streamlit re-runs the front-ends on every click."""
+    return SemanticCache()
@@ -0,0 +1,485 @@
+import asyncio
+import codecs
+import html
+import math
+import re
+import threading
+import time
+import weakref
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import orjson
+import requests
+import requests_cache
+import streamlit as st
+from googlesearch import search
+from lxml import etree, html as lxml_html
+import tiktoken
+import xxhash
+from requests.adapters import HTTPAdapter
+from requests_cache import DEFAULT_IGNORED_PARAMS
+
+from config import load_config
+
+# Pages are read only up to this many bytes; the excerpt kept for context is far shorter.
+_MAX_PAGE_BYTES = 256_000
+
+# Documents declaring more than this are skipped outright rather than truncated.
+_MAX_DOCUMENT_BYTES = 2_000_000
+
+# Media types worth parsing; anything else (PDFs, images, video) is skipped unread.
+_HTML_TYPES = ('text/html', 'application/xhtml+xml')
+
+# Cap on simultaneous page fetches so a single query stays polite to remote hosts.
+_MAX_CONCURRENT_FETCHES = 5
+
+# One fetch semaphore per event loop; each Streamlit session may run its own loop.
+_fetch_slots: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+# Blocking HTTP calls run on this pool. It lives for the whole process, unlike the default
+# executor that asyncio.run() creates and tears down on every Streamlit rerun.
+_FETCH_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix='searchshell-fetch')
+
+# Minimum spacing, in seconds, between requests to the same host.
+_HOST_INTERVAL = 1.0
+
+# host -> earliest time.monotonic() at which the next request to it may start. Shared by
+# every session's thread; hosts whose slot has passed are pruned once the table is large.
+_HOST_TABLE_SIZE = 256
+_next_allowed: dict[str, float] = {}
+_next_allowed_lock = threading.Lock()
+
+# Elements whose text never belongs in the extracted content.
+_STRIP_TAGS = (etree.Comment, 'script', 'style', 'nav', 'header', 'footer', 'iframe', 'noscript')
+
+# Seconds a fetched page is reused from the HTTP cache, unless its own headers say otherwise.
+_PAGE_TTL = 900
+
+# url -> (time.monotonic() deadline, (title, body)), oldest first. Checked before the per-host
+# throttle, so a repeat visit costs neither a wait nor a round trip. An entry lives only as
+# long as the HTTP cache would serve the response, so no-store and max-age are respected.
+_EXTRACTED_CACHE_SIZE = 512
+_extracted: OrderedDict[str, tuple[float, tuple[str, str]]] = OrderedDict()
+_extracted_lock = threading.Lock()
+
+# (query, num_results) -> (time.monotonic() when searched, urls), oldest first, for Google
+# searches. Kept in-process rather than in st.cache_data since the search runs on _FETCH_POOL.
+_SEARCH_TTL = 3600
+_SEARCH_CACHE_SIZE = 256
+_searched: OrderedDict[tuple[str, int], tuple[float, list[str]]] = OrderedDict()
+_searched_lock = threading.Lock()
+
+# Parsed pages kept in memory, keyed on a digest of the body rather than the body itself.
+_PARSE_CACHE_SIZE = 256
+_parsed: OrderedDict[tuple[int, str | None], tuple[str, str]] = OrderedDict()
+_parsed_lock = threading.Lock()
+
+# Pages with at most this much markup are checked for being short enough to use whole;
+# larger ones go straight to the main-content search, sparing them an extra text pass.
+_SHORT_PAGE_BYTES = 32_000
+
+# Text shorter than this (before whitespace is collapsed) needs no main-content search.
+_SHORT_PAGE_CHARS = 4000
+
+# HTML parsers reused across pages, per thread (lxml parsers must not be shared between
+# threads) and per encoding.
+_parsers = threading.local()
+
+# Matches <div>s carrying one of the usual main-content class names as a whole token.
+_CONTENT_DIV_XPATH = etree.XPath(
+    "//div[contains(concat(' ', normalize-space(@class), ' '), ' content ')"
+    " or contains(concat(' ', normalize-space(@class), ' '), ' main ')"
+    " or contains(concat(' ', normalize-space(@class), ' '), ' article ')]"
+)
+
+# Any whitespace run containing a line break, i.e. line-edge padding and blank lines.
+_WS_COLLAPSE = re.compile(r'\s*\n\s*')
+
+_WORD = re.compile(r'\w+')
+
+_TAG = re.compile(r'<[^>]+>')
+
+_BRAVE_SEARCH_URL = 'https://api.search.brave.com/res/v1/web/search'
+
+# Upper bound on the page text sent to a model; prompt size drives both cost and latency.
+CONTEXT_TOKEN_BUDGET = 6000
+
+def _media_type(response: requests.Response) -> str:
+    return response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+
+def _content_length(response: requests.Response) -> int:
+    return int(response.headers.get('Content-Length') or 0)
+
+def _cacheable(response: requests.Response) -> bool:
+    """Keep oversized and non-page responses out of the HTTP cache, which would otherwise download them whole.
+
+    Pages sent without a Content-Length (chunked dynamic HTML) could be any size, so
+    they are never cached; only then does the _MAX_PAGE_BYTES read cap bound the download.
+    API JSON is small and is cached regardless.
+    """
+    media_type = _media_type(response)
+    if media_type == 'application/json':
+        return True
+    return (media_type in _HTML_TYPES
+            and 'Content-Length' in response.headers
+            and _content_length(response) <= _MAX_PAGE_BYTES)
+
+# One session for every front-end, so repeat hosts reuse pooled keep-alive connections.
+# Responses are cached on disk; only 200s are stored and a stale entry is served
+# if revalidation fails, so a transient error never replaces good content. Servers'
+# Cache-Control/Expires headers take precedence over _PAGE_TTL, and expired entries
+# are revalidated with If-None-Match/If-Modified-Since so an unchanged page is a 304.
+SESSION = requests_cache.CachedSession(
+    cache_name='searchshell',
+    backend='sqlite',
+    expire_after=_PAGE_TTL,
+    cache_control=True,
+    stale_if_error=True,
+    filter_fn=_cacheable,
+    # Credentials are left out of cache keys and redacted from stored requests.
+    ignored_parameters=(*DEFAULT_IGNORED_PARAMS, 'X-Subscription-Token'),
+)
+SESSION.headers.update({
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+})
+SESSION.mount('http://', HTTPAdapter(pool_connections=20, pool_maxsize=32))
+SESSION.mount('https://', HTTPAdapter(pool_connections=20, pool_maxsize=32))
+
+def _fetch_semaphore() -> asyncio.Semaphore:
+    """Return the running loop's semaphore allowing _MAX_CONCURRENT_FETCHES fetches at once."""
+    loop = asyncio.get_running_loop()
+    semaphore = _fetch_slots.get(loop)
+    if semaphore is None:
+        semaphore = _fetch_slots[loop] = asyncio.Semaphore(_MAX_CONCURRENT_FETCHES)
+    return semaphore
+
+def _page_encoding(response: requests.Response, content: bytes) -> str | None:
+    """Pick the charset to decode a page with, or None to let lxml sniff <meta charset>."""
+    if 'charset=' in response.headers.get('Content-Type', ''):
+        return response.encoding
+    try:
+        # Not final, so a character cut in half by the byte cap doesn't count against UTF-8.
+        codecs.getincrementaldecoder('utf-8')().decode(content)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return None
+
+def _read_capped(response: requests.Response) -> bytes:
+    """Read the body up to _MAX_PAGE_BYTES; chunked responses arrive one HTTP chunk at a time."""
+    content = bytearray()
+    for chunk in response.iter_content(_MAX_PAGE_BYTES):
+        content += chunk
+        if len(content) >= _MAX_PAGE_BYTES:
+            break
+    return bytes(content[:_MAX_PAGE_BYTES])
+
+def _fresh_for(response: requests.Response) -> float:
+    """Seconds the HTTP cache will keep serving this response; 0 if it was not stored."""
+    expires = getattr(response, 'expires', None)
+    if expires is None:
+        return 0.0
+    return max(0.0, (expires - datetime.now(timezone.utc)).total_seconds())
+
+def _fetch_page(url: str) -> tuple[bytes, str | None, float]:
+    """GET a page, reading at most _MAX_PAGE_BYTES of its body.
+
+    Returns the body, its charset and how many seconds it may be reused for.
+    Non-HTML and oversized documents are rejected from the headers alone and come back empty.
+    """
+    with SESSION.get(url, timeout=10, stream=True) as response:
+        response.raise_for_status()
+        media_type = _media_type(response)
+        if (media_type and media_type not in _HTML_TYPES) or _content_length(response) > _MAX_DOCUMENT_BYTES:
+            return b'', None, 0.0
+        content = _read_capped(response)
+        return content, _page_encoding(response, content), _fresh_for(response)
+
+def _google_search(query: str, num_results: int) -> list[str]:
+    return list(search(query, num_results=num_results))
+
+async def _search_urls(query: str, num_results: int) -> list[str]:
+    """Run a Google search off the event loop, memoized so repeated queries skip the round-trip."""
+    key = (query, num_results)
+    with _searched_lock:
+        cached = _searched.get(key)
+    if cached and time.monotonic() - cached[0] < _SEARCH_TTL:
+        return cached[1]
+
+    urls = await _run_blocking(_google_search, query, num_results)
+    # googlesearch returns nothing when throttled; that is left out of the memo.
+    if urls:
+        with _searched_lock:
+            _searched[key] = (time.monotonic(), urls)
+            _searched.move_to_end(key)
+            if len(_searched) > _SEARCH_CACHE_SIZE:
+                _searched.popitem(last=False)
+    return urls
+
+def _canonical_url(url: str) -> str:
+    """Normalize a URL for de-duplication by dropping utm_* tracking parameters and the fragment."""
+    parts = urlparse(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if not key.startswith('utm_')]
+    return urlunparse(parts._replace(query=urlencode(query), fragment=''))
+
+def _unique_results(results: list[dict]) -> list[dict]:
+    """Drop results pointing at a page already listed, keyed on the canonical URL.
+
+    The canonical form is only compared; results keep their original href, since
+    re-encoding the query string can change what a server returns.
+    """
+    seen = set()
+    unique = []
+    for result in results:
+        url = _canonical_url(result['href'])
+        if url not in seen:
+            seen.add(url)
+            unique.append(result)
+    return unique
+
+def _brave_search(query: str, num_results: int, api_key: str) -> list[dict]:
+    """Search with the Brave Search API, which returns titles and snippets in one round-trip."""
+    response = SESSION.get(
+        _BRAVE_SEARCH_URL,
+        params={'q': query, 'count': num_results},
+        headers={'Accept': 'application/json', 'X-Subscription-Token': api_key},
+        timeout=10
+    )
+    response.raise_for_status()
+    results = orjson.loads(response.content).get('web', {}).get('results', [])
+    return [{
+        'href': result['url'],
+        'title': result.get('title', ''),
+        'body': html.unescape(_TAG.sub('', result.get('description', '')))
+    } for result in results[:num_results]]
+
+async def _wait_for_host(url: str) -> None:
+    """Space out requests to the same host; requests to distinct hosts are never delayed."""
+    host = urlparse(url).netloc
+    with _next_allowed_lock:
+        now = time.monotonic()
+        # Reserve the slot before sleeping so concurrent fetches to one host queue up behind it.
+        start = max(now, _next_allowed.get(host, 0.0))
+        _next_allowed[host] = start + _HOST_INTERVAL
+        if len(_next_allowed) > _HOST_TABLE_SIZE:
+            for stale in [h for h, allowed in _next_allowed.items() if allowed <= now]:
+                del _next_allowed[stale]
+    if start > now:
+        await asyncio.sleep(start - now)
+
+async def _run_blocking(func, *args):
+    """Run a blocking call on the shared fetch pool without stalling the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(_FETCH_POOL, func, *args)
+
+async def fetch(url: str) -> tuple[bytes, str | None, float]:
+    """Fetch a page off the event loop, returning its (capped) body, charset and freshness.
+
+    The per-host wait happens before a fetch slot is taken, so fetches queued behind
+    a busy host never hold up fetches to other hosts.
+    """
+    await _wait_for_host(url)
+    async with _fetch_semaphore():
+        return await _run_blocking(_fetch_page, url)
+
+def _html_parser(encoding: str | None) -> lxml_html.HTMLParser:
+    by_encoding = getattr(_parsers, 'by_encoding', None)
+    if by_encoding is None:
+        by_encoding = _parsers.by_encoding = {}
+    parser = by_encoding.get(encoding)
+    if parser is None:
+        parser = by_encoding[encoding] = lxml_html.HTMLParser(encoding=encoding, remove_blank_text=True)
+    return parser
+
+def _parse_page(content: bytes, encoding: str | None) -> tuple[str, str]:
+    try:
+        tree = lxml_html.fromstring(content, parser=_html_parser(encoding))
+    except etree.ParserError:
+        # A blank or whitespace-only body has no document to extract from.
+        return '', ''
+    title = (tree.findtext('.//title') or '').strip()
+
+    etree.strip_elements(tree, *_STRIP_TAGS, with_tail=False)
+
+    text = '\n'.join(tree.itertext()) if len(content) <= _SHORT_PAGE_BYTES else ''
+    if not text or len(text) >= _SHORT_PAGE_CHARS:
+        main_content = tree.xpath('//main') or tree.xpath('//article') or _CONTENT_DIV_XPATH(tree)
+        node = main_content[0] if main_content else tree
+        text = '\n'.join(node.itertext())
+
+    cleaned_text = _WS_COLLAPSE.sub('\n', text.strip())
+    return title, cleaned_text[:2000]
+
+def parse_page(content: bytes, encoding: str | None = None) -> tuple[str, str]:
+    """Parse a page into its title and up to 2000 characters of main content.
+
+    Results are memoized across wrappers and sessions, so a page fetched again
+    (e.g. from the HTTP cache) skips the parse.
+    """
+    key = (xxhash.xxh3_128_intdigest(content), encoding)
+    with _parsed_lock:
+        if key in _parsed:
+            _parsed.move_to_end(key)
+            return _parsed[key]
+
+    parsed = _parse_page(content, encoding)
+    with _parsed_lock:
+        _parsed[key] = parsed
+        if len(_parsed) > _PARSE_CACHE_SIZE:
+            _parsed.popitem(last=False)
+    return parsed
+
+async def extract_content(url: str) -> tuple[str, str]:
+    """Extract the title and main content from a webpage in a single fetch.
+
+    Pages still fresh in the HTTP cache are returned without fetching or parsing again.
+    """
+    with _extracted_lock:
+        cached = _extracted.get(url)
+    if cached and time.monotonic() < cached[0]:
+        return cached[1]
+
+    try:
+        content, encoding, fresh_for = await fetch(url)
+        if content:
+            title, body = parse_page(content, encoding)
+            page = (title or url, body)
+        else:
+            page = (url, "")
+    except Exception as e:
+        st.error(f"Error extracting content from {url}: {e}")
+        return url, ""
+
+    if not fresh_for:
+        return page
+    with _extracted_lock:
+        _extracted[url] = (time.monotonic() + fresh_for, page)
+        _extracted.move_to_end(url)
+        if len(_extracted) > _EXTRACTED_CACHE_SIZE:
+            _extracted.popitem(last=False)
+    return page
+
+async def _fetch_result(result: dict) -> dict:
+    """Fetch a single result page, reading its title and content from one response."""
+    url = result['href']
+    st.info(f"Fetching content from: {url}")
+    title, body = await extract_content(url)
+    return {'href': url, 'title': result['title'] or title, 'body': body or result['body']}
+
+def approx_tokens(text: str) -> int:
+    """Estimate a token count at roughly four characters per token."""
+    return len(text) // 4
+
+@lru_cache(maxsize=1)
+def _openai_encoding() -> tiktoken.Encoding:
+    return tiktoken.get_encoding("o200k_base")
+
+def openai_tokens(text: str) -> int:
+    """Count tokens the way OpenAI's GPT-4o family tokenizes them."""
+    return len(_openai_encoding().encode(text))
+
+def _dedupe_lines(results: list[dict]) -> list[dict]:
+    """Drop body lines already seen in an earlier result, e.g. boilerplate shared across sites."""
+    seen = set()
+    deduped = []
+    for result in results:
+        lines = []
+        for line in result['body'].split('\n'):
+            if line not in seen:
+                seen.add(line)
+                lines.append(line)
+        deduped.append({**result, 'body': '\n'.join(lines)})
+    return deduped
+
+def _relevance(lines: list[str], query: str) -> list[float]:
+    """Score each line by the TF-IDF weight of the query's terms within it."""
+    terms = set(_WORD.findall(query.lower()))
+    docs = [Counter(_WORD.findall(line.lower())) for line in lines]
+    df = Counter(term for doc in docs for term in terms & doc.keys())
+    idf = {term: math.log((1 + len(docs)) / (1 + df[term])) + 1 for term in df}
+    return [
+        sum(doc[term] * weight for term, weight in idf.items()) / (sum(doc.values()) or 1)
+        for doc in docs
+    ]
+
+def fit_results(results: list[dict], query: str, max_tokens: int = CONTEXT_TOKEN_BUDGET,
+                count_tokens=approx_tokens) -> list[dict]:
+    """Trim result bodies to a token budget, keeping the lines most relevant to the query."""
+    # Every token spans at least one byte, so bodies this small fit without counting tokens.
+    if sum(len(result['body'].encode('utf-8')) for result in results) <= max_tokens:
+        return results
+
+    lines = [(i, line) for i, result in enumerate(results) for line in result['body'].split('\n') if line]
+    costs = [count_tokens(line) for _, line in lines]
+    if sum(costs) <= max_tokens:
+        return results
+
+    scores = _relevance([line for _, line in lines], query)
+    keep = set()
+    remaining = max_tokens
+    # Stable sort, so ties (typically lines with no query terms) favour higher-ranked results.
+    for index in sorted(range(len(lines)), key=lambda k: scores[k], reverse=True):
+        if costs[index] <= remaining:
+            keep.add(index)
+            remaining -= costs[index]
+
+    bodies = [[] for _ in results]
+    for index, (i, line) in enumerate(lines):
+        if index in keep:
+            bodies[i].append(line)
+    return [{**result, 'body': '\n'.join(body)} for result, body in zip(results, bodies)]
+
+async def search_web(query: str, num_results: int = 3, deep_fetch: bool = True) -> list[dict]:
+    """Search the web and return results with their content.
+
+    Uses the Brave Search API when a [brave] api_key is configured, falling back to
+    scraping Google. With deep_fetch off, Brave's snippets are used as-is and no
+    result pages are downloaded; Google results are always fetched.
+    """
+    try:
+        api_key = load_config().get('brave', {}).get('api_key')
+        if api_key:
+            results = await _run_blocking(_brave_search, query, num_results, api_key)
+        else:
+            results = [{'href': url, 'title': '', 'body': ''} for url in await _search_urls(query, num_results)]
+
+        results = _unique_results(results)
+        if deep_fetch or not api_key:
+            results = await asyncio.gather(*(_fetch_result(result) for result in results))
+        return _dedupe_lines(results)
+    except Exception as e:
+        st.error(f"Error searching web: {e}")
+        return []
+
+async def gather_context(query: str, num_results: int = 3, max_tokens: int = CONTEXT_TOKEN_BUDGET,
+                         count_tokens=approx_tokens, deep_fetch: bool = True) -> str:
+    """Generate context from web search results, trimmed to a token budget."""
+    results = await search_web(query, num_results, deep_fetch)
+    results = fit_results(results, query, max_tokens, count_tokens)
+    context = []
+
+    for result in results:
+        url = result['href']
+        title = result['title']
+        content = result['body']
+
+        if content:
+            context_entry = (
+                f"Source: {title}\n"
+                f"URL: {url}\n\n"
+                f"Content:\n{content}\n"
+                f"{'='*50}\n"
+            )
+            context.append(context_entry)
+        else:
+            context_entry = (
+                f"Source: {title}\n"
+                f"URL: {url}\n"
+                f"{'='*50}\n"
+            )
+            context.append(context_entry)
+
+    return "\n".join(context)